@@ -0,0 +1,324 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import _posixshmem  # ตัวเดียวกับที่ multiprocessing.shared_memory ใช้บน POSIX
+except ImportError:  # Windows
+    _posixshmem = None
+
+# ---------- Layout ----------
+# [ring header (64 B)] [slot 0] [slot 1] ... [slot N-1]
+# slot = [slot header (64 B)] [decoded frame (h*w*c B)] [jpeg (jpeg_cap B)]
+#
+# Single writer per ring. Each slot is guarded by a seqlock: the writer sets
+# seq_begin, fills the slot, then sets seq_end; a reader is consistent only if
+# seq_end == seq_begin == the seq it asked for after copying the data out.
+#
+# generation is random per ring and is zeroed by the owner right before it
+# unlinks the segment, so readers in other processes can tell their mapping
+# is dead (e.g. ring recreated after a frame-size change) and re-attach.
+RING_MAGIC = b"VCFR"
+RING_HEADER = struct.Struct("<4sIIIIIIIQQ")  # magic, slots, h, w, c, jpeg_cap, owner_pid, _, generation, latest_seq
+RING_HEADER_SIZE = 64
+GENERATION_OFFSET = RING_HEADER.size - 16
+LATEST_SEQ_OFFSET = RING_HEADER.size - 8
+SLOT_HEADER_SIZE = 64
+SEQ_BEGIN_OFFSET = 0   # Q
+JPEG_LEN_OFFSET = 8    # I
+SEQ_END_OFFSET = 16    # Q
+
+# JPEG q70 ของภาพจริงเล็กกว่า raw ราว 10-20 เท่า; เผื่อไว้ 1/4 (ใหญ่กว่านี้ commit จะข้ามเฟรม)
+JPEG_CAP_RATIO = 4
+JPEG_CAP_MIN = 64 * 1024
+
+DEFAULT_SLOTS = 4
+READ_RETRIES = 3
+
+# shm name -> generation ของ ring ที่ process นี้เป็นเจ้าของและยังไม่ปิด
+_owned_rings: Dict[str, int] = {}
+_owned_rings_lock = threading.Lock()
+
+
+def ring_name(camera_id: str) -> str:
+    """Deterministic shm name so other processes can attach by camera_id."""
+    digest = hashlib.sha1(camera_id.encode("utf-8")).hexdigest()[:16]
+    return f"vc_frames_{digest}"
+
+
+def _align(n: int, to: int = 64) -> int:
+    return (n + to - 1) // to * to
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _open_untracked(name: str) -> shared_memory.SharedMemory:
+    """Open an existing segment without letting this process's resource_tracker unlink it."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # กัน resource_tracker ของ reader ลบ shm ของ writer ตอน process จบ
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _read_header(name: str) -> Optional[tuple]:
+    """Ring header currently behind `name`, or None if missing / not a ring.
+
+    Uses shm_open + mmap directly so it never touches resource_tracker
+    registrations (the owner's own registration must survive the peek).
+    """
+    if _posixshmem is None:
+        return None
+    try:
+        fd = _posixshmem.shm_open("/" + name, os.O_RDONLY, mode=0o600)
+    except FileNotFoundError:
+        return None
+    try:
+        if os.fstat(fd).st_size < RING_HEADER_SIZE:
+            return None
+        with mmap.mmap(fd, RING_HEADER_SIZE, prot=mmap.PROT_READ) as m:
+            header = RING_HEADER.unpack_from(m, 0)
+    finally:
+        os.close(fd)
+    return header if header[0] == RING_MAGIC else None
+
+
+def _owner_alive(name: str, header: Optional[tuple]) -> bool:
+    if header is None:
+        return False
+    owner_pid = header[6]
+    if owner_pid == os.getpid():
+        # pid ตัวเอง: ยังมีชีวิตก็ต่อเมื่อ ring นั้นยังลงทะเบียนอยู่ใน process นี้
+        with _owned_rings_lock:
+            return _owned_rings.get(name) == header[8]
+    return _pid_alive(owner_pid)
+
+
+class FrameRing:
+    """Per-camera ring of decoded + JPEG-encoded frames in shared memory."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self._write_lock = threading.Lock()  # stage/commit (writer) vs close
+        self._buf_lock = threading.Lock()    # short reads vs close; never held during a raw copy
+        self._closed = False
+        self._unlinked = False
+
+        magic, slots, h, w, c, jpeg_cap, owner_pid, _, generation, _ = RING_HEADER.unpack_from(shm.buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f"{shm.name} is not a frame ring")
+        self.slots = slots
+        self.shape = (h, w, c) if c > 1 else (h, w)
+        self.raw_size = h * w * c
+        self.jpeg_cap = jpeg_cap
+        self.owner_pid = owner_pid
+        self.generation = generation
+        self.token = f"{generation:016x}"  # shared by every process attached to this ring
+        self.slot_size = _align(SLOT_HEADER_SIZE + self.raw_size + jpeg_cap)
+        self._next_seq = self.latest_seq + 1
+
+    # ---------- Create / Attach ----------
+    @classmethod
+    def create(cls, camera_id: str, shape: Tuple[int, ...], slots: int = DEFAULT_SLOTS) -> "FrameRing":
+        h, w = shape[:2]
+        c = shape[2] if len(shape) > 2 else 1
+        raw_size = h * w * c
+        jpeg_cap = max(raw_size // JPEG_CAP_RATIO, JPEG_CAP_MIN)
+        slot_size = _align(SLOT_HEADER_SIZE + raw_size + jpeg_cap)
+        size = RING_HEADER_SIZE + slots * slot_size
+
+        name = ring_name(camera_id)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            header = _read_header(name)
+            if _owner_alive(name, header):
+                raise FileExistsError(f"{name} is owned by live process {header[6]}")
+            # ของเก่าค้างจาก process ที่ตายไป → ลบแล้วสร้างใหม่
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        try:
+            # SharedMemory แค่ ftruncate → /dev/shm เต็มจะไป SIGBUS ตอนเขียน; จองจริงตอนสร้างเลย
+            if hasattr(os, "posix_fallocate") and hasattr(shm, "_fd"):
+                os.posix_fallocate(shm._fd, 0, size)
+            generation = uuid.uuid4().int & ((1 << 64) - 1) or 1
+            RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, slots, h, w, c, jpeg_cap, os.getpid(), 0, generation, 0)
+            for i in range(slots):
+                off = RING_HEADER_SIZE + i * slot_size
+                shm.buf[off:off + SLOT_HEADER_SIZE] = bytes(SLOT_HEADER_SIZE)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        with _owned_rings_lock:
+            _owned_rings[name] = generation
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, camera_id: str) -> "FrameRing":
+        """Open an existing ring read-only from another process."""
+        return cls(_open_untracked(ring_name(camera_id)), owner=False)
+
+    def fits(self, shape: Tuple[int, ...]) -> bool:
+        return tuple(shape) == self.shape
+
+    def close(self) -> None:
+        """Release the mapping (and, for the owner, retire + unlink the segment).
+
+        Views returned by read_latest() must be dropped first: otherwise the
+        BufferError from shm.close() is re-raised and the ring stays open, so
+        close() can be called again once they are gone.
+        """
+        with self._write_lock, self._buf_lock:
+            if self._closed:
+                return
+            if self.owner and not self._unlinked:
+                name = self.shm.name
+                header = _read_header(name)
+                with _owned_rings_lock:
+                    if _owned_rings.get(name) == self.generation:
+                        del _owned_rings[name]
+                    # unlink เฉพาะถ้าชื่อยังชี้มาที่ ring นี้ (ไม่ลบ ring ใหม่ที่สร้างทับชื่อเดิม)
+                    ours = header[8] == self.generation if header else _owned_rings.get(name) is None
+                struct.pack_into("<Q", self.shm.buf, GENERATION_OFFSET, 0)
+                if ours:
+                    try:
+                        self.shm.unlink()
+                    except FileNotFoundError:
+                        pass
+                self._unlinked = True
+            self.shm.close()
+            self._closed = True
+
+    # ---------- Header helpers ----------
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def latest_seq(self) -> int:
+        """Newest published seq (0 if none yet or this handle is closed)."""
+        if self._closed:
+            return 0
+        return struct.unpack_from("<Q", self.shm.buf, LATEST_SEQ_OFFSET)[0]
+
+    @property
+    def retired(self) -> bool:
+        """True once the owner has unlinked this segment (or this handle is closed); attach() again to follow it."""
+        if self._closed:
+            return True
+        return struct.unpack_from("<Q", self.shm.buf, GENERATION_OFFSET)[0] != self.generation
+
+    def _slot_offset(self, seq: int) -> int:
+        return RING_HEADER_SIZE + (seq % self.slots) * self.slot_size
+
+    def _raw_view(self, off: int) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=off + SLOT_HEADER_SIZE)
+
+    def _jpeg_view(self, off: int, length: int) -> memoryview:
+        start = off + SLOT_HEADER_SIZE + self.raw_size
+        return self.shm.buf[start:start + length]
+
+    # ---------- Writer ----------
+    def stage(self, frame: np.ndarray) -> Optional[int]:
+        """Copy a decoded frame into the next slot; returns its seq (unpublished until commit)."""
+        with self._write_lock:
+            if self._unlinked or self._closed:
+                return None
+            seq = self._next_seq
+            self._next_seq += 1
+            off = self._slot_offset(seq)
+            struct.pack_into("<Q", self.shm.buf, off + SEQ_BEGIN_OFFSET, seq)
+            self._raw_view(off)[...] = frame
+            return seq
+
+    def commit(self, seq: Optional[int], jpeg: np.ndarray) -> bool:
+        """Attach the encoded JPEG to a staged slot and publish it as latest."""
+        if seq is None:
+            return False
+        data = memoryview(jpeg).cast("B")
+        with self._write_lock:
+            if self._unlinked or self._closed or len(data) > self.jpeg_cap:
+                return False
+            off = self._slot_offset(seq)
+            if struct.unpack_from("<Q", self.shm.buf, off + SEQ_BEGIN_OFFSET)[0] != seq:
+                return False  # slot ถูกเขียนทับไปแล้ว
+            self._jpeg_view(off, len(data))[:] = data
+            struct.pack_into("<I", self.shm.buf, off + JPEG_LEN_OFFSET, len(data))
+            struct.pack_into("<Q", self.shm.buf, off + SEQ_END_OFFSET, seq)
+            struct.pack_into("<Q", self.shm.buf, LATEST_SEQ_OFFSET, seq)
+            return True
+
+    # ---------- Readers ----------
+    def latest_jpeg(self, since: int = 0) -> Optional[Tuple[int, bytes]]:
+        """(seq, jpeg bytes) of the newest frame, or None if nothing newer than `since`.
+
+        Lock-free against the writer (seqlock); a torn read is retried.
+        """
+        with self._buf_lock:
+            if self._closed:
+                return None
+            for _ in range(READ_RETRIES):
+                seq = self.latest_seq
+                if seq == 0 or seq <= since:
+                    return None
+                off = self._slot_offset(seq)
+                length = struct.unpack_from("<I", self.shm.buf, off + JPEG_LEN_OFFSET)[0]
+                if length > self.jpeg_cap:
+                    continue
+                view = self._jpeg_view(off, length)
+                data = bytes(view)
+                view.release()
+                if self.is_valid(seq):
+                    return seq, data
+            return None
+
+    def read_latest(self) -> Optional[Tuple[int, np.ndarray, memoryview]]:
+        """Zero-copy views (seq, frame, jpeg) into the newest slot.
+
+        Returns None when nothing is published yet or the ring is retired
+        (check `retired` and attach() again). The views alias shared memory
+        and may be overwritten by the writer; copy what you need, then call
+        is_valid(seq) to make sure it was not torn. Also None once closed.
+        """
+        if self.retired:
+            return None
+        seq = self.latest_seq
+        if seq == 0:
+            return None
+        off = self._slot_offset(seq)
+        length = struct.unpack_from("<I", self.shm.buf, off + JPEG_LEN_OFFSET)[0]
+        if length > self.jpeg_cap or not self.is_valid(seq):
+            return None
+        return seq, self._raw_view(off), self._jpeg_view(off, length)
+
+    def is_valid(self, seq: int) -> bool:
+        if self._closed:
+            return False
+        off = self._slot_offset(seq)
+        end = struct.unpack_from("<Q", self.shm.buf, off + SEQ_END_OFFSET)[0]
+        begin = struct.unpack_from("<Q", self.shm.buf, off + SEQ_BEGIN_OFFSET)[0]
+        return begin == end == seq and not self.retired
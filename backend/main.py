@@ -10,13 +10,16 @@ from collections import defaultdict
 
 import cv2
 import numpy as np
-from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from ultralytics import YOLO
 
+from frame_ring import FrameRing
+
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
@@ -393,215 +396,351 @@ def _line_side(cx: int, cy: int, lx1: int, ly1: int, lx2: int, ly2: int) -> floa
     return float((lx2 - lx1) * (cy - ly1) - (ly2 - ly1) * (cx - lx1))
 
 
-# ---------- Detection WebSocket ----------
-@app.websocket("/ws/detect/{camera_id}")
-async def ws_detect(websocket: WebSocket, camera_id: str):
-    await websocket.accept()
-
-    # 1) ดึงข้อมูลกล้องจาก DB
-    cam = await cameras.find_one({"camera_id": camera_id}, {"_id": 0})
-    if not cam:
-        await websocket.send_json({"error": "camera not found"})
-        await websocket.close()
-        return
-
-    stream_url = cam.get("hls_url") or cam.get("rtsp")
-    if not stream_url:
-        await websocket.send_json({"error": "no stream URL configured"})
-        await websocket.close()
-        return
-
-    # 2) เปิด VideoCapture ใน thread แยก พร้อมส่งเฟรมผ่าน queue
-    import json
-
-    stop_event = threading.Event()
-    frame_queue = asyncio.Queue(maxsize=2)
-    loop = asyncio.get_event_loop()
-
-    # Tracking state
-    counted_ids: set = set()
-    count_totals: Dict[str, int] = defaultdict(int)
-    session_id = uuid.uuid4().hex[:8]  # unique per WS session
-
-    # Majority voting per track ID
-    track_votes: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    track_top_conf: Dict[int, float] = {}        # best confidence seen
-    track_prev_side: Dict[int, float] = {}       # previous side of counting line
-
-    # ดึง active line สำหรับ camera นี้ (ถ้ามี)
-    active_line = await lines.find_one({"camera_id": camera_id, "is_active": True}, {"_id": 0})
-    active_line_id = active_line["line_id"] if active_line else "no_line"
-
-    def detection_thread():
-        """Thread: อ่าน stream → YOLO track → majority vote + line-crossing → นับ"""
-        cap = cv2.VideoCapture(stream_url)
+# ---------- Camera Producers ----------
+JPEG_QUALITY = 70
+MJPEG_DEFAULT_FPS = 15.0
+MJPEG_MAX_FPS = 30.0
+PRODUCER_IDLE_SEC = 30.0   # ไม่มีใครใช้แล้ว capture ต่ออีกเท่านี้ (dashboard poll snapshot เป็นช่วง ๆ)
+SNAPSHOT_WAIT_SEC = 5.0    # snapshot แรกของกล้องที่ยังไม่ได้เปิด รอเฟรมแรกได้นานเท่านี้
+FRAME_STALE_SEC = 5.0      # เฟรมล่าสุดเก่ากว่านี้ = ไม่ปัจจุบัน (stream ขาด / commit ไม่ผ่าน)
+COMMIT_DROP_LOG_EVERY = 100
+
+
+class CameraProducer:
+    """One capture per camera, shared by snapshot, MJPEG and WS consumers.
+
+    Each frame is decoded and JPEG-encoded once and written to the camera's
+    FrameRing. YOLO + counting only run while at least one WS is subscribed;
+    every WS gets the same payload (base64 computed once per frame).
+    """
+
+    def __init__(self, camera_id: str, stream_url: str, loop: asyncio.AbstractEventLoop):
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.loop = loop
+        # แก้ภายใต้ camera_producers_lock
+        self.users = 0
+        self.last_used = time.time()
+        self.subscribers: List[asyncio.Queue] = []
+        self.active_line: Optional[Dict[str, Any]] = None
+        self._restart_detection = False
+        self.ring: Optional[FrameRing] = None
+        self.error: Optional[str] = None
+        # เขียนโดย producer thread เท่านั้น
+        self.ring_error: Optional[str] = None
+        self.last_frame_at = 0.0
+        self.dropped_commits = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    # ---------- Consumers (event loop) ----------
+    def subscribe(self, queue: asyncio.Queue, active_line: Optional[Dict[str, Any]]) -> None:
+        with camera_producers_lock:
+            if self.error:
+                queue.put_nowait({"error": self.error})
+                return
+            if not self.subscribers:
+                # WS แรก → เริ่มนับรอบใหม่ด้วย active line ปัจจุบัน
+                self.active_line = active_line
+                self._restart_detection = True
+            self.subscribers.append(queue)
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with camera_producers_lock:
+            if queue in self.subscribers:
+                self.subscribers.remove(queue)
+
+    def latest_jpeg(self, token: Optional[str] = None, since: int = 0):
+        """(token, seq, jpeg) of the current frame, or None if none / stale / not newer than (token, since)."""
+        ring = self.ring
+        if ring is None or time.time() - self.last_frame_at > FRAME_STALE_SEC:
+            return None
+        latest = ring.latest_jpeg(since=since if ring.token == token else 0)
+        if not latest:
+            return None
+        return ring.token, latest[0], latest[1]
+
+    def unavailable_reason(self) -> str:
+        return self.error or self.ring_error or "no frame available"
+
+    # ---------- Lifecycle (ภายใต้ camera_producers_lock) ----------
+    def _retire_locked(self) -> None:
+        if camera_producers.get(self.camera_id) is self:
+            del camera_producers[self.camera_id]
+        self.stop_event.set()
+        if self.ring is not None:
+            ring, self.ring = self.ring, None
+            try:
+                ring.close()
+            except Exception as e:
+                print(f"[SHM] close ring for {self.camera_id} failed: {e}")
+
+    def _should_stop(self) -> bool:
+        with camera_producers_lock:
+            idle = self.users == 0 and time.time() - self.last_used > PRODUCER_IDLE_SEC
+            if not (self.stop_event.is_set() or idle):
+                return False
+            self._retire_locked()
+            return True
+
+    def _fail(self, message: str) -> None:
+        with camera_producers_lock:
+            self.error = message
+            subscribers = list(self.subscribers)
+            self._retire_locked()
+        for queue in subscribers:
+            self._offer(queue, {"error": message})
+
+    def _detection_state(self):
+        with camera_producers_lock:
+            restart, self._restart_detection = self._restart_detection, False
+            return list(self.subscribers), self.active_line, restart
+
+    def _ring_for(self, shape: tuple) -> Optional[FrameRing]:
+        """The camera's ring, (re)created when the frame size changes; close + create under one lock."""
+        ring = self.ring
+        if ring is not None and ring.fits(shape):
+            return ring
+        with camera_producers_lock:
+            if self.stop_event.is_set():
+                return None
+            if self.ring is not None:
+                old, self.ring = self.ring, None
+                old.close()
+            self.ring = FrameRing.create(self.camera_id, shape)
+            return self.ring
+
+    def _offer(self, queue: asyncio.Queue, payload: Dict[str, Any]) -> None:
+        try:
+            self.loop.call_soon_threadsafe(_offer_frame, queue, payload)
+        except RuntimeError:
+            pass  # event loop ปิดแล้ว (shutdown)
+
+    # ---------- Thread ----------
+    def _run(self) -> None:
+        """Thread: อ่าน stream → (มี WS) YOLO track + majority vote + line-crossing → JPEG ครั้งเดียว → ring + WS"""
+        camera_id = self.camera_id
+        cap = cv2.VideoCapture(self.stream_url)
         if not cap.isOpened():
-            asyncio.run_coroutine_threadsafe(
-                frame_queue.put({"error": "cannot open stream"}), loop
-            )
+            self._fail("cannot open stream")
             return
 
         prev_t = time.time()
         frame_count = 0
+        ring_enabled = True
 
-        # Scale counting line to frame coords (set on first frame)
-        line_pts = None  # (lx1, ly1, lx2, ly2) in frame pixels
-
-        while not stop_event.is_set():
+        while not self._should_stop():
             ret, frame = cap.read()
             if not ret:
                 # stream อาจขาด ลอง reconnect
                 cap.release()
                 time.sleep(1)
-                cap = cv2.VideoCapture(stream_url)
+                cap = cv2.VideoCapture(self.stream_url)
                 continue
 
             h, w = frame.shape[:2]
 
-            # Scale counting line to frame size (once)
-            if line_pts is None and active_line:
-                cw = active_line.get("canvas_w", 1280)
-                ch = active_line.get("canvas_h", 720)
-                sx, sy = w / cw, h / ch
-                p1 = active_line["p1"]
-                p2 = active_line["p2"]
-                line_pts = (
-                    int(p1["x"] * sx), int(p1["y"] * sy),
-                    int(p2["x"] * sx), int(p2["y"] * sy),
+            # เก็บเฟรมที่ decode แล้วลง shared memory ก่อนวาด overlay
+            # (ring เป็นของเสริม: พังก็แค่ปิดไว้ ไม่ให้กระทบการนับ/WS)
+            ring, seq = None, None
+            if ring_enabled:
+                try:
+                    ring = self._ring_for(frame.shape)
+                    if ring is not None:
+                        seq = ring.stage(frame)
+                except Exception as e:
+                    print(f"[SHM] frame ring disabled for {camera_id}: {e}")
+                    self.ring_error = f"frame ring unavailable: {e}"
+                    ring_enabled = False
+                    ring = None
+
+            subscribers, active_line, restart = self._detection_state()
+            if restart:
+                # Tracking state (รอบใหม่ทุกครั้งที่มี WS แรกเข้ามา)
+                counted_ids: set = set()
+                count_totals: Dict[str, int] = defaultdict(int)
+                session_id = uuid.uuid4().hex[:8]  # unique per detection run
+
+                # Majority voting per track ID
+                track_votes: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+                track_top_conf: Dict[int, float] = {}        # best confidence seen
+                track_prev_side: Dict[int, float] = {}       # previous side of counting line
+
+                active_line_id = active_line["line_id"] if active_line else "no_line"
+                line_pts = None  # (lx1, ly1, lx2, ly2) in frame pixels
+                prev_t = time.time()
+
+            cur_fps = 0.0
+            if subscribers:
+                # Scale counting line to frame size (once)
+                if line_pts is None and active_line:
+                    cw = active_line.get("canvas_w", 1280)
+                    ch = active_line.get("canvas_h", 720)
+                    sx, sy = w / cw, h / ch
+                    p1 = active_line["p1"]
+                    p2 = active_line["p2"]
+                    line_pts = (
+                        int(p1["x"] * sx), int(p1["y"] * sy),
+                        int(p2["x"] * sx), int(p2["y"] * sy),
+                    )
+
+                # YOLO track
+                results = yolo_model.track(
+                    source=frame,
+                    conf=CONF,
+                    persist=True,
+                    tracker=TRACKER,
+                    verbose=False,
                 )
+                r = results[0]
+
+                detections_list = []
+                new_counts = []
+
+                if r.boxes is not None and len(r.boxes) > 0 and r.boxes.id is not None:
+                    boxes = r.boxes.xyxy.cpu().numpy().astype(int)
+                    clss = r.boxes.cls.cpu().numpy().astype(int)
+                    confs = r.boxes.conf.cpu().numpy()
+                    ids = r.boxes.id.cpu().numpy().astype(int)
+
+                    for (x1, y1, x2, y2), cls_id, conf, tid in zip(boxes, clss, confs, ids):
+                        cx = (x1 + x2) // 2
+                        cy = (y1 + y2) // 2
+                        cls_name = yolo_names.get(int(cls_id), str(int(cls_id)))
+
+                        detections_list.append({
+                            "id": f"det-{int(tid)}",
+                            "x": int(x1),
+                            "y": int(y1),
+                            "width": int(x2 - x1),
+                            "height": int(y2 - y1),
+                            "type": cls_name,
+                            "confidence": round(float(conf) * 100, 1),
+                            "label": cls_name,
+                            "track_id": int(tid),
+                        })
+
+                        # วาด bounding box ลงบนเฟรม
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                        cv2.circle(frame, (cx, cy), 4, (0, 255, 255), -1)
+                        cv2.putText(
+                            frame,
+                            f"{cls_name} #{int(tid)}",
+                            (x1, max(20, y1 - 8)),
+                            cv2.FONT_HERSHEY_SIMPLEX,
+                            0.6,
+                            (0, 255, 0),
+                            2,
+                        )
 
-            # YOLO track
-            results = yolo_model.track(
-                source=frame,
-                conf=CONF,
-                persist=True,
-                tracker=TRACKER,
-                verbose=False,
-            )
-            r = results[0]
-
-            detections_list = []
-            new_counts = []
-
-            if r.boxes is not None and len(r.boxes) > 0 and r.boxes.id is not None:
-                boxes = r.boxes.xyxy.cpu().numpy().astype(int)
-                clss = r.boxes.cls.cpu().numpy().astype(int)
-                confs = r.boxes.conf.cpu().numpy()
-                ids = r.boxes.id.cpu().numpy().astype(int)
-
-                for (x1, y1, x2, y2), cls_id, conf, tid in zip(boxes, clss, confs, ids):
-                    cx = (x1 + x2) // 2
-                    cy = (y1 + y2) // 2
-                    cls_name = yolo_names.get(int(cls_id), str(int(cls_id)))
-
-                    detections_list.append({
-                        "id": f"det-{int(tid)}",
-                        "x": int(x1),
-                        "y": int(y1),
-                        "width": int(x2 - x1),
-                        "height": int(y2 - y1),
-                        "type": cls_name,
-                        "confidence": round(float(conf) * 100, 1),
-                        "label": cls_name,
-                        "track_id": int(tid),
-                    })
-
-                    # วาด bounding box ลงบนเฟรม
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.circle(frame, (cx, cy), 4, (0, 255, 255), -1)
+                        # --- Majority voting + line-crossing ---
+                        conf_pct = round(float(conf) * 100, 1)
+                        t_id = int(tid)
+
+                        if t_id not in counted_ids and conf_pct >= COUNT_CONF_MIN:
+                            # ลงคะแนน class
+                            track_votes[t_id][cls_name] += 1
+                            track_top_conf[t_id] = max(
+                                track_top_conf.get(t_id, 0.0), conf_pct
+                            )
+                            total_votes = sum(track_votes[t_id].values())
+                            ready = total_votes >= VOTE_MIN
+
+                            # Line-crossing check (ถ้ามีเส้นนับ)
+                            crossed = False
+                            if line_pts:
+                                lx1, ly1, lx2, ly2 = line_pts
+                                side = _line_side(cx, cy, lx1, ly1, lx2, ly2)
+                                prev = track_prev_side.get(t_id)
+                                if prev is not None and prev * side < 0 and ready:
+                                    crossed = True
+                                track_prev_side[t_id] = side
+
+                            should_count = crossed if line_pts else ready
+
+                            if should_count:
+                                # เลือก class ที่เห็นบ่อยสุด (majority vote)
+                                final_cls = max(
+                                    track_votes[t_id],
+                                    key=track_votes[t_id].get,  # type: ignore
+                                )
+                                count_totals[final_cls] += 1
+                                counted_ids.add(t_id)
+                                new_counts.append(
+                                    {
+                                        "camera_id": camera_id,
+                                        "track_id": t_id,
+                                        "class": final_cls,
+                                        "confidence": track_top_conf.get(t_id, conf_pct),
+                                        "bbox": [int(x1), int(y1), int(x2 - x1), int(y2 - y1)],
+                                        "time": datetime.now().isoformat(),
+                                    }
+                                )
+
+                # FPS
+                now = time.time()
+                dt = max(now - prev_t, 1e-6)
+                cur_fps = 1.0 / dt
+                prev_t = now
+                frame_count += 1
+
+                # วาด FPS + counts ลงบนเฟรม
+                cv2.putText(
+                    frame,
+                    f"FPS: {cur_fps:.1f}",
+                    (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8,
+                    (255, 255, 255),
+                    2,
+                )
+                y_pos = 55
+                for k, v in sorted(count_totals.items()):
                     cv2.putText(
                         frame,
-                        f"{cls_name} #{int(tid)}",
-                        (x1, max(20, y1 - 8)),
+                        f"{k}: {v}",
+                        (10, y_pos),
                         cv2.FONT_HERSHEY_SIMPLEX,
                         0.6,
-                        (0, 255, 0),
+                        (255, 255, 255),
                         2,
                     )
+                    y_pos += 22
 
-                    # --- Majority voting + line-crossing ---
-                    conf_pct = round(float(conf) * 100, 1)
-                    t_id = int(tid)
+                # Draw counting line
+                if line_pts:
+                    lx1, ly1, lx2, ly2 = line_pts
+                    cv2.line(frame, (lx1, ly1), (lx2, ly2), (0, 0, 255), 2)
 
-                    if t_id not in counted_ids and conf_pct >= COUNT_CONF_MIN:
-                        # ลงคะแนน class
-                        track_votes[t_id][cls_name] += 1
-                        track_top_conf[t_id] = max(
-                            track_top_conf.get(t_id, 0.0), conf_pct
-                        )
-                        total_votes = sum(track_votes[t_id].values())
-                        ready = total_votes >= VOTE_MIN
-
-                        # Line-crossing check (ถ้ามีเส้นนับ)
-                        crossed = False
-                        if line_pts:
-                            lx1, ly1, lx2, ly2 = line_pts
-                            side = _line_side(cx, cy, lx1, ly1, lx2, ly2)
-                            prev = track_prev_side.get(t_id)
-                            if prev is not None and prev * side < 0 and ready:
-                                crossed = True
-                            track_prev_side[t_id] = side
-
-                        should_count = crossed if line_pts else ready
-
-                        if should_count:
-                            # เลือก class ที่เห็นบ่อยสุด (majority vote)
-                            final_cls = max(
-                                track_votes[t_id],
-                                key=track_votes[t_id].get,  # type: ignore
-                            )
-                            count_totals[final_cls] += 1
-                            counted_ids.add(t_id)
-                            new_counts.append(
-                                {
-                                    "camera_id": camera_id,
-                                    "track_id": t_id,
-                                    "class": final_cls,
-                                    "confidence": track_top_conf.get(t_id, conf_pct),
-                                    "bbox": [int(x1), int(y1), int(x2 - x1), int(y2 - y1)],
-                                    "time": datetime.now().isoformat(),
-                                }
+            # Encode frame as JPEG (ครั้งเดียวต่อเฟรม ไม่ว่าจะมี consumer กี่ตัว)
+            _, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if ring is not None:
+                try:
+                    if ring.commit(seq, jpeg):
+                        self.last_frame_at = time.time()
+                    else:
+                        # ไม่ publish → snapshot เห็นว่าเฟรมเก่า (FRAME_STALE_SEC) แทนที่จะเสิร์ฟเฟรมเดิมเงียบ ๆ
+                        self.dropped_commits += 1
+                        if self.dropped_commits % COMMIT_DROP_LOG_EVERY == 1:
+                            print(
+                                f"[SHM] {camera_id}: frame not published "
+                                f"(jpeg {len(jpeg)} B, cap {ring.jpeg_cap} B, dropped {self.dropped_commits})"
                             )
+                except Exception as e:
+                    print(f"[SHM] frame ring disabled for {camera_id}: {e}")
+                    self.ring_error = f"frame ring unavailable: {e}"
+                    ring_enabled = False
 
-            # FPS
-            now = time.time()
-            dt = max(now - prev_t, 1e-6)
-            cur_fps = 1.0 / dt
-            prev_t = now
-            frame_count += 1
-
-            # วาด FPS + counts ลงบนเฟรม
-            cv2.putText(
-                frame,
-                f"FPS: {cur_fps:.1f}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (255, 255, 255),
-                2,
-            )
-            y_pos = 55
-            for k, v in sorted(count_totals.items()):
-                cv2.putText(
-                    frame,
-                    f"{k}: {v}",
-                    (10, y_pos),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    (255, 255, 255),
-                    2,
-                )
-                y_pos += 22
+            if not subscribers:
+                continue
 
-            # Draw counting line
-            if line_pts:
-                lx1, ly1, lx2, ly2 = line_pts
-                cv2.line(frame, (lx1, ly1), (lx2, ly2), (0, 0, 255), 2)
+            # บันทึก counts ใหม่ลง DB ครั้งเดียว (ไม่ขึ้นกับจำนวน WS)
+            if new_counts:
+                asyncio.run_coroutine_threadsafe(
+                    _save_counts(new_counts, active_line_id, session_id), self.loop
+                )
 
-            # Encode frame as JPEG
-            _, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
             b64 = base64.b64encode(jpeg.tobytes()).decode("ascii")
-
             payload = {
                 "type": "frame",
                 "frame": b64,
@@ -612,51 +751,196 @@ async def ws_detect(websocket: WebSocket, camera_id: str):
                 "frame_w": w,
                 "frame_h": h,
             }
-
-            # ส่งเข้า queue (ถ้าเต็มก็ข้ามเฟรมเก่า)
-            try:
-                frame_queue.put_nowait(payload)
-            except asyncio.QueueFull:
-                try:
-                    frame_queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    pass
-                try:
-                    frame_queue.put_nowait(payload)
-                except asyncio.QueueFull:
-                    pass
+            for queue in subscribers:
+                self._offer(queue, payload)
 
         cap.release()
 
-    # เริ่ม detection thread
-    t = threading.Thread(target=detection_thread, daemon=True)
-    t.start()
 
+# camera_id -> CameraProducer ที่กำลังทำงาน
+camera_producers: Dict[str, CameraProducer] = {}
+camera_producers_lock = threading.Lock()
+
+
+def _offer_frame(queue: asyncio.Queue, payload: Dict[str, Any]) -> None:
+    # ส่งเข้า queue (ถ้าเต็มก็ข้ามเฟรมเก่า)
+    try:
+        queue.put_nowait(payload)
+    except asyncio.QueueFull:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass
+
+
+async def _save_counts(new_counts: List[Dict[str, Any]], line_id: str, session_id: str) -> None:
+    for nc in new_counts:
+        try:
+            count_id = f"cnt_{nc['camera_id']}_{line_id}_{session_id}_{nc['track_id']}"
+            await counts.insert_one(
+                {
+                    "count_id": count_id,
+                    "camera_id": nc["camera_id"],
+                    "line_id": line_id,
+                    "track_id": nc["track_id"],
+                    "class": nc["class"],
+                    "time": datetime.now(),
+                }
+            )
+        except Exception as e:
+            print(f"[DB] count insert skipped: {e}")
+
+
+async def _acquire_producer(camera_id: str) -> CameraProducer:
+    """Get (or start) the camera's producer and hold it until _release_producer()."""
+    with camera_producers_lock:
+        producer = camera_producers.get(camera_id)
+        if producer is not None:
+            producer.users += 1
+            return producer
+
+    cam = await cameras.find_one({"camera_id": camera_id}, {"_id": 0})
+    if not cam:
+        raise HTTPException(status_code=404, detail="camera not found")
+    stream_url = cam.get("hls_url") or cam.get("rtsp")
+    if not stream_url:
+        raise HTTPException(status_code=400, detail="no stream URL configured")
+
+    with camera_producers_lock:
+        producer = camera_producers.get(camera_id)
+        if producer is None:
+            producer = CameraProducer(camera_id, stream_url, asyncio.get_running_loop())
+            camera_producers[camera_id] = producer
+            producer.thread.start()
+        producer.users += 1
+        return producer
+
+
+def _release_producer(producer: CameraProducer) -> None:
+    with camera_producers_lock:
+        producer.users -= 1
+        producer.last_used = time.time()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    with camera_producers_lock:
+        producers = list(camera_producers.values())
+        for producer in producers:
+            producer.stop_event.set()
+    for producer in producers:
+        producer.thread.join(timeout=5)
+    with camera_producers_lock:
+        for producer in producers:
+            producer._retire_locked()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+# ---------- Snapshot / MJPEG ----------
+@app.get("/cameras/{camera_id}/snapshot")
+async def camera_snapshot(camera_id: str, request: Request):
+    producer = await _acquire_producer(camera_id)
     try:
+        deadline = time.time() + SNAPSHOT_WAIT_SEC
+        latest = producer.latest_jpeg()
+        while latest is None and not producer.stop_event.is_set() and time.time() < deadline:
+            await asyncio.sleep(0.1)
+            latest = producer.latest_jpeg()
+    finally:
+        _release_producer(producer)
+    if latest is None:
+        raise HTTPException(status_code=503, detail=producer.unavailable_reason())
+
+    token, seq, jpeg = latest
+    etag = f'"{token}-{seq}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=jpeg, media_type="image/jpeg", headers=headers)
+
+
+@app.get("/cameras/{camera_id}/mjpeg")
+async def camera_mjpeg(
+    camera_id: str,
+    request: Request,
+    fps: float = Query(default=MJPEG_DEFAULT_FPS, gt=0, le=MJPEG_MAX_FPS),
+):
+    # ตรวจกล้อง + เริ่ม producer ไว้ก่อน (404/400 ตอบเป็น HTTP error ได้)
+    _release_producer(await _acquire_producer(camera_id))
+
+    async def stream():
+        # hold producer ภายใน generator เพื่อให้ release แน่นอนตอน client ตัดการเชื่อมต่อ
+        try:
+            producer = await _acquire_producer(camera_id)
+        except HTTPException:
+            return
+        interval = 1.0 / fps
+        token, last_seq = None, 0
+        try:
+            while not producer.stop_event.is_set() and not await request.is_disconnected():
+                latest = producer.latest_jpeg(token, last_seq)
+                if latest:
+                    token, last_seq, jpeg = latest
+                    yield (
+                        b"--frame\r\nContent-Type: image/jpeg\r\n"
+                        + f"Content-Length: {len(jpeg)}\r\n\r\n".encode("ascii")
+                        + jpeg
+                        + b"\r\n"
+                    )
+                await asyncio.sleep(interval)
+        finally:
+            _release_producer(producer)
+
+    return StreamingResponse(
+        stream(),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+# ---------- Detection WebSocket ----------
+@app.websocket("/ws/detect/{camera_id}")
+async def ws_detect(websocket: WebSocket, camera_id: str):
+    await websocket.accept()
+
+    # 1) หา/เริ่ม producer ของกล้อง (capture + YOLO ใช้ร่วมกันทุก consumer)
+    try:
+        producer = await _acquire_producer(camera_id)
+    except HTTPException as e:
+        await websocket.send_json({"error": e.detail})
+        await websocket.close()
+        return
+
+    frame_queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    try:
+        # ดึง active line สำหรับ camera นี้ (ถ้ามี)
+        active_line = await lines.find_one({"camera_id": camera_id, "is_active": True}, {"_id": 0})
+        producer.subscribe(frame_queue, active_line)
+
         while True:
-            # รอข้อมูลจาก detection thread
+            # รอข้อมูลจาก producer thread
             payload = await frame_queue.get()
             if "error" in payload:
                 await websocket.send_json(payload)
                 break
 
-            # บันทึก counts ใหม่ลง DB (async)
-            for nc in payload.get("new_counts", []):
-                try:
-                    count_id = f"cnt_{nc['camera_id']}_{active_line_id}_{session_id}_{nc['track_id']}"
-                    await counts.insert_one(
-                        {
-                            "count_id": count_id,
-                            "camera_id": nc["camera_id"],
-                            "line_id": active_line_id,
-                            "track_id": nc["track_id"],
-                            "class": nc["class"],
-                            "time": datetime.now(),
-                        }
-                    )
-                except Exception as e:
-                    print(f"[DB] count insert skipped: {e}")
-
             # ส่ง frame + detections + new_counts ให้ frontend
             await websocket.send_json(payload)
 
@@ -665,5 +949,5 @@ async def ws_detect(websocket: WebSocket, camera_id: str):
     except Exception as e:
         print(f"[WS] Error: {e}")
     finally:
-        stop_event.set()
-        t.join(timeout=5)
+        producer.unsubscribe(frame_queue)
+        _release_producer(producer)